@@ -1,6 +1,20 @@
 import streamlit as st
 import pandas as pd
-from io import BytesIO
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+import csv
+import hashlib
+import os
+import tempfile
+import time
+from io import BytesIO, StringIO
+from itertools import chain
+from pathlib import Path
+from typing import NamedTuple
+from dataclasses import dataclass
 
 st.set_page_config(page_title="ETA Analysis • Shipment Level", layout="wide")
 st.title("ETA Analysis – Shipment Level")
@@ -10,65 +24,377 @@ st.caption("Filter by Stop, Accuracy Buckets, and Shipment Lane. Outputs one row
 st.sidebar.header("1) Load data")
 uploaded = st.sidebar.file_uploader("Upload CSV (prediction rows; shipment-level metrics repeated)", type=["csv"]) 
 
+NUMERIC_COLS = ("STOP_NUMBER", "TOTAL_PREDICTIONS", "PING_COVERAGE")
+NUMERIC_PREFIXES = ("ACCURACY_", "COUNT_OF_ACCURATE_PREDICTIONS_")
+# Numeric only if every value parses (as pd.read_csv would infer); otherwise kept as text for display
+SOFT_NUMERIC_COLS = ("PING_COVERAGE",)
+# Columns the app reads (matched case-insensitively); everything else is pruned at load
+USED_COLS = ("BILL_OF_LADING", "CARRIER_NAME", "SHIPMENT_LANE", "STOP_NUMBER", "PING_COVERAGE", "TOTAL_PREDICTIONS")
+# Low-cardinality text columns repeated on every prediction row
+CATEGORY_COLS = ("SHIPMENT_LANE", "CARRIER_NAME")
+TEXT_COLS = ("BILL_OF_LADING", "CARRIER_NAME", "SHIPMENT_LANE")
+# Accuracy buckets (minutes) the app can show
+BUCKET_KEYS = [30, 45, 60, 90, 120]
+# e.g. COUNT_OF_ACCURATE_PREDICTIONS_30_MINS / ACCURACY_30_MINS -> (kind, minutes)
+BUCKET_PATTERN = r"^(ACCURACY|COUNT_OF_ACCURATE_PREDICTIONS)_(\d+)_MINS$"
+CACHE_DIR = Path(".cache")
+# Bump whenever the cached Parquet layout changes, so files from older builds are not read back
+CACHE_VERSION = 3
+CACHE_MAX_BYTES = 2 << 30
+CACHE_TMP_MAX_AGE = 3600  # seconds
+
+def _upper_names(names) -> pd.Index:
+    return pd.Index(names).str.strip().str.upper()
+
+def _used_mask(upper: pd.Index):
+    return upper.isin(USED_COLS) | upper.str.startswith(NUMERIC_PREFIXES)
+
+def _coerce_numeric(col: pa.Array) -> pa.Array:
+    return pa.array(pd.to_numeric(col.to_pandas(), errors="coerce"), type=pa.float64(), from_pandas=True)
+
+def _dedupe_names(names) -> list:
+    # Same scheme as pd.read_csv: repeated "A" becomes "A.1", "A.2", ...
+    names = list(names)
+    counts = {}
+    for i, col in enumerate(names):
+        cur_count = counts.get(col, 0)
+        while cur_count > 0:
+            counts[col] = cur_count + 1
+            col = f"{col}.{cur_count}"
+            cur_count = counts.get(col, 0)
+        names[i] = col
+        counts[col] = cur_count + 1
+    return names
+
+def _csv_to_parquet(data: bytes, path: Path) -> None:
+    try:
+        _write_parquet(data, path, coerce=False)
+    except pa.ArrowInvalid as exc:
+        if "CSV conversion error" not in str(exc):
+            # Structural problem (e.g. short rows): let pandas parse it as the app always did
+            _write_parquet_pandas(data, path)
+            return
+        # Some numeric cell is text Arrow cannot parse (e.g. "-", "n.a."): re-read the numeric
+        # columns as strings and turn bad cells into NaN, like pd.to_numeric(errors="coerce").
+        # SOFT_NUMERIC_COLS stay text here; load_df converts them only if they fully parse.
+        try:
+            _write_parquet(data, path, coerce=True)
+        except pa.ArrowInvalid:
+            _write_parquet_pandas(data, path)
+
+def _write_parquet(data: bytes, path: Path, coerce: bool) -> None:
+    buf = pa.py_buffer(data)
+    # Peek the header so numeric columns are parsed as float64 up front (no second coercion pass)
+    raw_header = pv.open_csv(pa.BufferReader(buf), read_options=pv.ReadOptions(block_size=1 << 20)).schema.names
+    # Read under stripped, de-duplicated names so include_columns and the Parquet schema are unambiguous
+    header = pd.Index(_dedupe_names(c.strip() for c in raw_header))
+    upper = _upper_names(header)
+    used = _used_mask(upper)
+    numeric = upper.isin(NUMERIC_COLS) | upper.str.startswith(NUMERIC_PREFIXES)
+    # Streaming infers types from the first block only, so pin text columns too
+    column_types = {
+        **dict.fromkeys(header[used & upper.isin(TEXT_COLS)], pa.string()),
+        **dict.fromkeys(header[numeric], pa.string() if coerce else pa.float64()),
+    }
+    reader = pv.open_csv(
+        pa.BufferReader(buf),
+        read_options=pv.ReadOptions(block_size=16 << 20, use_threads=True, column_names=header.tolist(), skip_rows=1),
+        convert_options=pv.ConvertOptions(
+            include_columns=header[used].tolist(),
+            column_types=column_types,
+            # Blank text cells become null (as with pd.read_csv), not ""
+            strings_can_be_null=True,
+        ),
+    )
+    if coerce:
+        numeric = numeric & ~upper.isin(SOFT_NUMERIC_COLS)
+    is_numeric = numeric[used]
+    schema = pa.schema([pa.field(f.name, pa.float64() if num else f.type) for f, num in zip(reader.schema, is_numeric)])
+
+    def batches():
+        for batch in reader:
+            columns = [_coerce_numeric(c) if coerce and num else c for c, num in zip(batch.columns, is_numeric)]
+            yield pa.RecordBatch.from_arrays(columns, schema=schema)
+
+    _write_batches(path, schema, batches())
+
+def _write_parquet_pandas(data: bytes, path: Path) -> None:
+    # Slow path with the baseline's pd.read_csv semantics (short rows padded with NaN, etc.)
+    df = pd.read_csv(BytesIO(data))
+    df.columns = _dedupe_names(c.strip() for c in df.columns)
+    upper = _upper_names(df.columns)
+    df = df.loc[:, _used_mask(upper)]
+    fields = []
+    for c, u in zip(df.columns, _upper_names(df.columns)):
+        numeric = u in NUMERIC_COLS or u.startswith(NUMERIC_PREFIXES)
+        if numeric and (u not in SOFT_NUMERIC_COLS or pd.api.types.is_numeric_dtype(df[c])):
+            df[c] = pd.to_numeric(df[c], errors="coerce").astype("float64")
+            fields.append(pa.field(c, pa.float64()))
+        else:  # text columns, and soft numeric columns that did not fully parse
+            df[c] = df[c].astype("string")
+            fields.append(pa.field(c, pa.string()))
+    # Explicit schema: the same plain string/float64 types the Arrow path writes, no pandas metadata
+    table = pa.Table.from_pandas(df, schema=pa.schema(fields), preserve_index=False).replace_schema_metadata()
+    _write_batches(path, table.schema, table.to_batches())
+
+def _write_batches(path: Path, schema: pa.Schema, batches) -> None:
+    # Own temp file per writer: concurrent sessions may be caching the same upload
+    with tempfile.NamedTemporaryFile(dir=path.parent, suffix=".tmp", delete=False) as f:
+        tmp = Path(f.name)
+    try:
+        # Stream batch by batch so peak memory is one block, not the whole parsed CSV
+        with pq.ParquetWriter(tmp, schema, compression="snappy", use_dictionary=True) as writer:
+            for batch in batches:
+                writer.write_batch(batch, row_group_size=200_000)
+        tmp.replace(path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+def _evict_cache(keep: Path) -> None:
+    # Drop files from older cache versions and abandoned temp files, then the least recently
+    # used entries past the size cap
+    now = time.time()
+    entries = []
+    for p in CACHE_DIR.iterdir():
+        try:
+            stat = p.stat()
+        except FileNotFoundError:
+            continue
+        if p.suffix == ".tmp":
+            # A live writer keeps appending, so only long-untouched temp files are orphans
+            if now - stat.st_mtime > CACHE_TMP_MAX_AGE:
+                p.unlink(missing_ok=True)
+        elif not p.name.endswith(f"-v{CACHE_VERSION}.parquet"):
+            if p.suffix == ".parquet":
+                p.unlink(missing_ok=True)
+        else:
+            entries.append((stat.st_mtime, stat.st_size, p))
+    total = 0
+    for _, size, p in sorted(entries, key=lambda e: e[0], reverse=True):
+        total += size
+        if p != keep and total > CACHE_MAX_BYTES:
+            p.unlink(missing_ok=True)
+
+def _cache_parquet(data: bytes, path: Path) -> None:
+    try:
+        os.utime(path)  # recency for _evict_cache
+    except FileNotFoundError:
+        CACHE_DIR.mkdir(exist_ok=True)
+        _csv_to_parquet(data, path)
+        _evict_cache(keep=path)
+
+class LoadedData(NamedTuple):
+    df: pd.DataFrame
+    # STOP_NUMBER values in row order; df is sorted by them (NaN last), None if the column is absent
+    stop_arr: np.ndarray | None
+    # Content hash of the upload; stands in for df in downstream cache keys
+    key: str
+    # Sidebar options, computed once per upload rather than on every rerun
+    lanes: list | None
+    stop_min: int | None
+    stop_max: int | None
+    # Accuracy/count bucket columns, held outside df as one row-major float32 block whose
+    # columns follow bucket_cols (COUNT then ACCURACY per bucket); rows align with df positions
+    bucket_block: np.ndarray
+    bucket_cols: tuple
+
+# cache_resource: every rerun gets the loaded frame itself rather than an unpickled copy
+# of the whole upload; nothing writes to it (filters return new frames). Keyed on the
+# upload's file_id, since hashing the file argument re-reads all of its bytes each rerun.
+# Every upload gets a new file_id, so bound how many loaded files stay pinned in memory.
+@st.cache_resource(max_entries=4, ttl=3600)
+def load_df(_file, file_id: str) -> LoadedData:
+    data = _file.getvalue()
+    key = hashlib.blake2b(data).hexdigest()
+    # Parse the CSV once per distinct upload; later loads read the Parquet copy
+    path = CACHE_DIR / f"{key}-v{CACHE_VERSION}.parquet"
+    _cache_parquet(data, path)
+    try:
+        parquet = pq.ParquetFile(path)
+    except FileNotFoundError:
+        # Evicted by another session between the utime above and opening it
+        _cache_parquet(data, path)
+        parquet = pq.ParquetFile(path)
+    names = pd.Index(parquet.schema_arrow.names)
+    needed = names[_used_mask(_upper_names(names))].tolist()
+    # Text stays in Arrow buffers (string[pyarrow]) instead of one Python str per cell
+    df = parquet.read(columns=needed).to_pandas(
+        self_destruct=True, zero_copy_only=False, types_mapper={pa.string(): pd.StringDtype("pyarrow")}.get
+    )
+    for c in df.columns[df.columns.str.upper().isin(SOFT_NUMERIC_COLS)]:
+        if pd.api.types.is_string_dtype(df[c]):
+            try:
+                df[c] = pd.to_numeric(df[c]).to_numpy(dtype="float64", na_value=np.nan)
+            except (ValueError, TypeError):
+                pass  # e.g. "85%": shown as-is; KPIs coerce per value
+    for c in df.columns[df.columns.str.upper().isin(CATEGORY_COLS)]:
+        if pd.api.types.is_string_dtype(df[c]):
+            df[c] = df[c].astype("category")
+    upper = df.columns.str.upper()
+    stop_arr, stop_min, stop_max = None, None, None
+    stop_cols = df.columns[upper == "STOP_NUMBER"]
+    if len(stop_cols) > 0:
+        # Sort once so stop-range filters become a searchsorted slice
+        df = df.sort_values(stop_cols[0], kind="stable").reset_index(drop=True)
+        stop_arr = df[stop_cols[0]].to_numpy()
+        n_valid = np.count_nonzero(~np.isnan(stop_arr))  # NaNs sort last
+        if n_valid > 0:
+            stop_min, stop_max = int(stop_arr[0]), int(stop_arr[n_valid - 1])
+    lanes = None
+    lane_cols = df.columns[upper == "SHIPMENT_LANE"]
+    if len(lane_cols) > 0:
+        # Always categorical (text column, converted above): the options are its categories
+        lanes = sorted(df[lane_cols[0]].cat.categories.tolist())
+    parts = df.columns.str.extract(BUCKET_PATTERN, expand=True).dropna()
+    parts = parts.assign(minutes=parts[1].astype(int), is_acc=parts[0] == "ACCURACY").sort_values(["minutes", "is_acc"])
+    bucket_cols = tuple(df.columns[parts.index])
+    # Percentages and counts fit float32 (counts exact up to 2**24), halving their bytes.
+    # to_numpy on a frame gives a column-major array; make it row-major so gathering the
+    # shipment rows copies contiguous runs
+    bucket_block = np.ascontiguousarray(df[list(bucket_cols)].to_numpy(dtype=np.float32))
+    df = df.drop(columns=list(bucket_cols))
+    return LoadedData(df, stop_arr, key, lanes, stop_min, stop_max, bucket_block, bucket_cols)
+
+# Not cached: a slice plus one gather is cheaper than unpickling a cached copy of the result
+def filter_df(data: LoadedData, lane_col: str | None, stop_range: tuple | None, lanes: tuple | None) -> pd.DataFrame:
+    # Apply filters to PREDICTION-LEVEL rows (no aggregation yet).
+    # No copy needed: every filter below returns a new frame and the loaded df is never written to
+    df_f = data.df
+
+    if stop_range is not None and data.stop_arr is not None:
+        lo, hi = stop_range
+        # df is sorted by STOP_NUMBER, so the range is one contiguous slice
+        i0 = np.searchsorted(data.stop_arr, lo, side="left")
+        i1 = np.searchsorted(data.stop_arr, hi, side="right")
+        df_f = df_f.iloc[i0:i1]
+
+    if lanes is not None and lane_col in df_f.columns:
+        # load_df always reads the lane as text and makes it categorical, so filter on the
+        # codes: one gather over a lookup table builds the mask; the extra trailing slot is
+        # what code -1 (missing lane) indexes, and stays False
+        lane = df_f[lane_col]
+        allowed = np.zeros(len(lane.cat.categories) + 1, dtype=bool)
+        idx = lane.cat.categories.get_indexer(list(lanes))
+        allowed[idx[idx >= 0]] = True
+        df_f = df_f[allowed[lane.cat.codes.to_numpy()]]
+
+    return df_f
+
+# cache_resource hands back the cached frame itself (no unpickled copy per hit); callers
+# treat it as read-only
+@st.cache_resource(max_entries=4)
+def dedup_ship(_df_f: pd.DataFrame, filter_key: tuple, bol: str) -> pd.DataFrame:
+    # First row per BOL via Arrow: index_in finds each unique BOL's first position
+    bol_arr = pa.array(_df_f[bol])
+    if isinstance(bol_arr, pa.ChunkedArray):
+        bol_arr = bol_arr.combine_chunks()
+    first_idx = pc.index_in(pc.unique(bol_arr), value_set=bol_arr).to_numpy()
+    # Then sort only the unique BOLs for a stable display order
+    return _df_f.iloc[first_idx].sort_values(by=[bol])
+
+# Keyed on the filter and column selection rather than hashing the table on every rerun
+@st.cache_resource(max_entries=4)
+def make_csv_bytes(_out_df: pd.DataFrame, out_key: tuple) -> bytes:
+    # Arrow's C++ CSV writer; cached so reruns with the same table skip serialization
+    table = pa.Table.from_pandas(_out_df, preserve_index=False)
+    try:
+        # Unquoted, like the pandas exports this replaced
+        return _write_csv(table, "none")
+    except pa.ArrowInvalid:
+        # Some value contains a comma, quote or newline; "none" cannot write it
+        return _write_csv(table, "needed")
+
+def _write_csv(table: pa.Table, quoting_style: str) -> bytes:
+    # Arrow always quotes header names, so write the header with csv's minimal quoting instead
+    header = StringIO()
+    csv.writer(header, lineterminator="\n").writerow(table.column_names)
+    buf = pa.BufferOutputStream()
+    pv.write_csv(table, buf, write_options=pv.WriteOptions(include_header=False, quoting_style=quoting_style))
+    return header.getvalue().encode("utf-8") + buf.getvalue().to_pybytes()
+
+@dataclass(frozen=True)
+class SchemaInfo:
+    bol: str
+    carrier_name: str | None
+    shipment_lane: str | None
+    stop_number: str | None
+    ping_coverage: str | None
+    total_predictions: str | None
+    count_map: dict
+    acc_map: dict
+    available_buckets: tuple
+    # Column position of each bucket name inside LoadedData.bucket_block
+    block_pos: dict
+
 @st.cache_data
-def load_df(file) -> pd.DataFrame:
-    df = pd.read_csv(file)
-    df.columns = [c.strip() for c in df.columns]
-    # Normalize likely numeric cols
-    for c in ["STOP_NUMBER", "TOTAL_PREDICTIONS"]:
-        if c in df.columns:
-            df[c] = pd.to_numeric(df[c], errors="coerce")
-    # Accuracy & count columns numeric
-    for c in df.columns:
-        if c.upper().startswith("ACCURACY_") or c.upper().startswith("COUNT_OF_ACCURATE_PREDICTIONS_"):
-            df[c] = pd.to_numeric(df[c], errors="coerce")
-    return df
+def schema_info(columns: tuple, bucket_cols: tuple) -> SchemaInfo:
+    # Pure function of the column names, so reruns skip the introspection below
+    cols = dict(zip(pd.Index(columns, dtype=object).str.upper(), columns))
+
+    bucket_names = pd.Index(bucket_cols, dtype=object)
+    bucket_parts = bucket_names.str.extract(BUCKET_PATTERN, expand=True)
+
+    def _bucket_map(kind: str) -> dict:
+        hit = (bucket_parts[0] == kind).to_numpy()
+        return dict(zip(map(int, bucket_parts[1][hit]), bucket_names[hit]))
+
+    count_map = _bucket_map("COUNT_OF_ACCURATE_PREDICTIONS")
+    acc_map = _bucket_map("ACCURACY")
+    return SchemaInfo(
+        bol=cols.get("BILL_OF_LADING", "BILL_OF_LADING"),
+        carrier_name=cols.get("CARRIER_NAME", None),
+        shipment_lane=cols.get("SHIPMENT_LANE", None),
+        stop_number=cols.get("STOP_NUMBER", None),
+        ping_coverage=cols.get("PING_COVERAGE", None),
+        total_predictions=cols.get("TOTAL_PREDICTIONS", None),
+        count_map=count_map,
+        acc_map=acc_map,
+        available_buckets=tuple(sorted(set(count_map) & set(acc_map) & set(BUCKET_KEYS))),
+        block_pos={c: i for i, c in enumerate(bucket_cols)},
+    )
 
 if uploaded is None:
     st.info("👆 Upload your CSV to begin. The app assumes **each row is a prediction** and shipment-level fields repeat.")
     st.stop()
 
-df_raw = load_df(uploaded)
-cols = {c.upper(): c for c in df_raw.columns}
+try:
+    data = load_df(uploaded, uploaded.file_id)
+except (pa.ArrowInvalid, pd.errors.ParserError, UnicodeDecodeError) as exc:
+    st.error(f"Could not read the uploaded CSV: {exc}")
+    st.stop()
+df_raw = data.df
+schema = schema_info(tuple(df_raw.columns), data.bucket_cols)
 
 # Canonical columns
-BOL = cols.get("BILL_OF_LADING", "BILL_OF_LADING")
-CARRIER_NAME = cols.get("CARRIER_NAME", None)
-SHIPMENT_LANE = cols.get("SHIPMENT_LANE", None)
-STOP_NUMBER = cols.get("STOP_NUMBER", None)
-PING_COVERAGE = cols.get("PING_COVERAGE", None)
-TOTAL_PREDICTIONS = cols.get("TOTAL_PREDICTIONS", None)
+BOL = schema.bol
+CARRIER_NAME = schema.carrier_name
+SHIPMENT_LANE = schema.shipment_lane
+STOP_NUMBER = schema.stop_number
+PING_COVERAGE = schema.ping_coverage
+TOTAL_PREDICTIONS = schema.total_predictions
 
 # Accuracy buckets: map to BOTH count & accuracy columns
-BUCKET_KEYS = [30, 45, 60, 90, 120]
-count_map = {}
-acc_map = {}
-for m in BUCKET_KEYS:
-    cnt_name = f"COUNT_OF_ACCURATE_PREDICTIONS_{m}_MINS"
-    acc_name = f"ACCURACY_{m}_MINS"
-    if cnt_name in df_raw.columns:
-        count_map[m] = cnt_name
-    if acc_name in df_raw.columns:
-        acc_map[m] = acc_name
+count_map = schema.count_map
+acc_map = schema.acc_map
 
 # --- Sidebar filters
 st.sidebar.header("2) Filters")
 
 # STOP_NUMBER range selection only (removed single option)
-stop_filter = None
+stop_range = None
 if STOP_NUMBER and STOP_NUMBER in df_raw.columns:
-    valid_stops = sorted(df_raw[STOP_NUMBER].dropna().unique())
-    if len(valid_stops) > 0:
-        s_min, s_max = int(min(valid_stops)), int(max(valid_stops))
+    if data.stop_min is not None:
+        s_min, s_max = data.stop_min, data.stop_max
         lo, hi = st.sidebar.slider("STOP_NUMBER range (inclusive)", min_value=s_min, max_value=s_max, value=(s_min, s_max))
-        stop_filter = ("range", (lo, hi))
+        stop_range = (lo, hi)
     else:
         st.sidebar.caption("No numeric STOP_NUMBER values found.")
 else:
     st.sidebar.caption("STOP_NUMBER column not found – skipping stop filter.")
 
 # Accuracy bucket multi-select (choose which pairs to show)
-available_buckets = [m for m in BUCKET_KEYS if (m in count_map and m in acc_map)]
+available_buckets = list(schema.available_buckets)
 selected_buckets = st.sidebar.multiselect(
     "Accuracy buckets to show",
     options=available_buckets,
@@ -79,23 +405,14 @@ selected_buckets = st.sidebar.multiselect(
 # Shipment Lane filter
 selected_lanes = None
 if SHIPMENT_LANE and SHIPMENT_LANE in df_raw.columns:
-    lanes = sorted([x for x in df_raw[SHIPMENT_LANE].dropna().unique()])
-    if len(lanes) > 0:
+    lanes = data.lanes
+    if lanes:
         selected_lanes = st.sidebar.multiselect("Shipment lane(s)", options=lanes, default=lanes)
 
-# --- Apply filters to PREDICTION-LEVEL rows (no aggregation yet) (no aggregation yet)
-df_f = df_raw.copy()
-
-if stop_filter and STOP_NUMBER in df_f.columns:
-    mode, val = stop_filter
-    if mode == "Single":
-        df_f = df_f[df_f[STOP_NUMBER] == val]
-    else:
-        lo, hi = val
-        df_f = df_f[(df_f[STOP_NUMBER] >= lo) & (df_f[STOP_NUMBER] <= hi)]
-
-if selected_lanes is not None and SHIPMENT_LANE in df_f.columns:
-    df_f = df_f[df_f[SHIPMENT_LANE].isin(selected_lanes)]
+# --- Apply filters to PREDICTION-LEVEL rows; the dedup below is cached per (upload, stop range, lanes)
+lanes_key = tuple(selected_lanes) if selected_lanes is not None else None
+filter_key = (data.key, stop_range, lanes_key)
+df_f = filter_df(data, SHIPMENT_LANE, stop_range, lanes_key)
 
 # If no rows remain, show a friendly message
 if df_f.empty:
@@ -103,50 +420,57 @@ if df_f.empty:
     st.stop()
 
 # --- Shipment-level output: one row per BOL (take first occurrence)
-if BOL in df_f.columns:
-    # Coerce to string to avoid mixed-type sort errors
-    df_f[BOL] = df_f[BOL].astype(str)
-    try:
-        df_ship = df_f.sort_values(by=[BOL]).drop_duplicates(subset=[BOL], keep="first")
-    except Exception:
-        df_ship = df_f.drop_duplicates(subset=[BOL], keep="first")
-else:
+if BOL not in df_f.columns:
     st.error("BILL_OF_LADING column not found in the uploaded CSV.")
     st.stop()
 
 # Fixed columns for output (exclude ARRIVAL_WITHIN_APPOINTMENT_WINDOW as requested)
-fixed_cols = [c for c in [BOL, CARRIER_NAME, SHIPMENT_LANE, PING_COVERAGE, TOTAL_PREDICTIONS] if c and c in df_ship.columns]
+fixed_cols = [c for c in [BOL, CARRIER_NAME, SHIPMENT_LANE, PING_COVERAGE, TOTAL_PREDICTIONS] if c and c in df_f.columns]
 
 # Dynamic bucket columns: for each selected bucket, show COUNT then ACCURACY next to it
-bucket_cols = []
-for m in selected_buckets:
-    if m in count_map:
-        bucket_cols.append(count_map[m])
-    if m in acc_map:
-        bucket_cols.append(acc_map[m])
+bucket_cols = list(chain.from_iterable((count_map[m], acc_map[m]) for m in selected_buckets))
 
 show_cols = fixed_cols + bucket_cols
 
-missing = [c for c in show_cols if c not in df_ship.columns]
+available_cols = set(df_f.columns).union(data.bucket_cols)
+missing = [c for c in show_cols if c not in available_cols]
 if missing:
     st.warning(f"Some selected columns are missing and will be skipped: {missing}")
-    show_cols = [c for c in show_cols if c in df_ship.columns]
+    show_cols = [c for c in show_cols if c in available_cols]
 
 st.subheader("Results")
 st.write("Filtered view at **shipment level** (one row per BILL_OF_LADING). Accuracy columns are shown as pairs: **count** then **percentage**.")
 
-out = df_ship[show_cols].copy()
+with st.spinner("Building shipment-level table..."):
+    df_ship = dedup_ship(df_f, filter_key, BOL)
+    # Bucket values come from the float32 block: shipment rows x selected bucket columns.
+    # df_ship's index holds row positions in the loaded frame (reset at load time).
+    block_pos = schema.block_pos
+    out_buckets = [c for c in show_cols if c in block_pos]
+    buckets = pd.DataFrame(
+        data.bucket_block[np.ix_(df_ship.index.to_numpy(), [block_pos[c] for c in out_buckets])],
+        columns=out_buckets,
+        index=df_ship.index,
+    )
+    # show_cols lists the fixed columns first, then the bucket pairs, so concatenating the
+    # two pieces already gives the display order: the table is built once
+    out = pd.concat([df_ship[[c for c in show_cols if c not in block_pos]], buckets], axis=1)
 
-# KPI row
+# KPI row (shipment KPIs read the same first-row-per-BOL table that is displayed)
 k1, k2, k3 = st.columns(3)
 with k1:
-    st.metric("Shipments (unique BOL)", value=f"{df_ship[BOL].nunique():,}")
+    st.metric("Shipments (unique BOL)", value=f"{len(df_ship):,}")
 with k2:
-    if PING_COVERAGE and PING_COVERAGE in out.columns:
-        try:
-            st.metric("Avg Ping Coverage", value=f"{pd.to_numeric(out[PING_COVERAGE], errors='coerce').mean():.2f}")
-        except Exception:
+    if PING_COVERAGE and PING_COVERAGE in df_ship.columns:
+        first_ping = df_ship[PING_COVERAGE]
+        if not pd.api.types.is_float_dtype(first_ping):
+            # Only text when some value did not parse at load (e.g. "85%")
+            first_ping = pd.to_numeric(first_ping, errors="coerce")
+        first_ping = first_ping.to_numpy(dtype="float64", na_value=np.nan)
+        if np.isnan(first_ping).all():
             st.metric("Avg Ping Coverage", value="—")
+        else:
+            st.metric("Avg Ping Coverage", value=f"{np.nanmean(first_ping):.2f}")
     else:
         st.metric("Avg Ping Coverage", value="—")
 with k3:
@@ -156,10 +480,9 @@ with k3:
 st.dataframe(out, use_container_width=True)
 
 # Download
-csv_bytes = out.to_csv(index=False).encode("utf-8")
 st.download_button(
     label="Download filtered table as CSV",
-    data=csv_bytes,
+    data=make_csv_bytes(out, (filter_key, tuple(show_cols))),
     file_name="eta_shipment_level_filtered.csv",
     mime="text/csv",
 )
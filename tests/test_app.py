@@ -0,0 +1,179 @@
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("pyarrow")
+import pyarrow.compute as pc
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+APP_PATH = str(Path(__file__).resolve().parents[1] / "steamlit_app.py")
+
+HEADER = (
+    "BILL_OF_LADING,CARRIER_NAME,SHIPMENT_LANE,STOP_NUMBER,PING_COVERAGE,TOTAL_PREDICTIONS,"
+    "COUNT_OF_ACCURATE_PREDICTIONS_30_MINS,ACCURACY_30_MINS\n"
+)
+
+
+def _app(csv_bytes: bytes, app_path: str) -> None:
+    # file_uploader cannot be driven from AppTest, so hand the script the upload directly
+    import hashlib
+    import io
+    import runpy
+
+    import streamlit as st
+
+    upload = io.BytesIO(csv_bytes)
+    upload.file_id = hashlib.sha256(csv_bytes).hexdigest()
+    st.sidebar.file_uploader = lambda *args, **kwargs: upload
+    # Keep the export bytes where the test can read them (AppTest exposes no media files)
+    download_button = getattr(st.download_button, "unrecorded", st.download_button)
+
+    def record_download(*args, **kwargs):
+        st.session_state["download"] = kwargs["data"]
+        return download_button(*args, **kwargs)
+
+    record_download.unrecorded = download_button
+    st.download_button = record_download
+    runpy.run_path(app_path, run_name="__main__")
+
+
+def run_app(csv_text: str) -> AppTest:
+    at = AppTest.from_function(_app, args=(csv_text.encode(), APP_PATH), default_timeout=60)
+    at.run()
+    assert not at.exception, [e.message for e in at.exception]
+    return at
+
+
+@pytest.fixture(autouse=True)
+def _cache_in_tmp(tmp_path, monkeypatch):
+    # The Parquet cache lives under ./.cache; in-memory caches are process-wide
+    monkeypatch.chdir(tmp_path)
+    st.cache_data.clear()
+    st.cache_resource.clear()
+
+
+def test_dirty_numeric_cell_becomes_nan():
+    at = run_app(HEADER + "B1,C1,L1,1,10,3,2,50\nB2,C1,L1,2,20,2,1,n.a.\n")
+    out = at.dataframe[0].value.set_index("BILL_OF_LADING")
+    assert out.loc["B1", "ACCURACY_30_MINS"] == 50
+    assert out["ACCURACY_30_MINS"].isna().loc["B2"]
+
+
+def test_blank_lane_is_missing_not_an_option():
+    at = run_app(HEADER + "B1,C1,L1,1,10,3,2,50\nB2,C2,,2,20,2,1,10\n")
+    assert at.sidebar.multiselect[1].options == ["L1"]
+    assert at.dataframe[0].value["BILL_OF_LADING"].tolist() == ["B1"]
+
+
+def test_kpis_match_shipment_table():
+    at = run_app(HEADER + "B1,C1,L1,1,,3,2,50\nB1,C1,L1,2,60,3,2,50\nB2,C2,L1,1,40,2,1,10\n")
+    kpis = {m.label: m.value for m in at.metric}
+    assert kpis["Shipments (unique BOL)"] == "2"
+    assert kpis["Avg Ping Coverage"] == "40.00"
+    assert kpis["Total Predictions (rows)"] == "3"
+
+
+def test_formatted_ping_coverage_is_kept_as_text():
+    at = run_app(HEADER + "B1,C1,L1,1,85%,3,2,50\nB2,C2,L1,2,-,2,1,10\n")
+    out = at.dataframe[0].value.set_index("BILL_OF_LADING")
+    assert out.loc["B1", "PING_COVERAGE"] == "85%"
+    assert {m.label: m.value for m in at.metric}["Avg Ping Coverage"] == "—"
+
+
+def test_short_rows_are_padded_with_nan():
+    at = run_app(HEADER + "B1,C1,L1,1,10,3,2,50\nB2,C1,L1,2,10,3\n")
+    out = at.dataframe[0].value.set_index("BILL_OF_LADING")
+    assert out.loc["B1", "ACCURACY_30_MINS"] == 50
+    assert out["ACCURACY_30_MINS"].isna().loc["B2"]
+
+
+def test_duplicate_header_keeps_first_column():
+    header = HEADER.replace("ACCURACY_30_MINS", "ACCURACY_30_MINS,STOP_NUMBER")
+    at = run_app(header + "B1,C1,L1,1,10,3,2,50,7\nB2,C1,L1,2,20,2,1,10,8\n")
+    assert at.sidebar.slider[0].value == (1, 2)
+    out = at.dataframe[0].value.set_index("BILL_OF_LADING")
+    assert out.loc["B2", "ACCURACY_30_MINS"] == 10
+
+
+def _sparse(path: Path, size: int, age: float) -> None:
+    with open(path, "wb") as f:
+        f.truncate(size)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+
+
+def test_cache_eviction():
+    run_app(HEADER + "B1,C1,L1,1,10,3,2,50\nB2,C1,L1,2,20,2,1,10\n")
+    cache = Path(".cache")
+    (kept,) = cache.glob("*.parquet")
+    os.utime(kept, (time.time() - 50, time.time() - 50))
+    version = kept.name.split("-", 1)[1]
+    _sparse(cache / f"big-{version}", 3 << 30, age=100)  # least recently used, over the cap
+    _sparse(cache / "old-v0.parquet", 3 << 30, age=0)  # stale version: removed, not counted
+    _sparse(cache / "orphan.tmp", 10, age=7200)
+    _sparse(cache / "live.tmp", 10, age=0)
+    run_app(HEADER + "B1,C1,L1,1,10,3,2,50\nB3,C1,L1,2,20,2,1,10\n")
+    names = {p.name for p in cache.iterdir()}
+    assert kept.name in names and "live.tmp" in names
+    assert not names & {f"big-{version}", "old-v0.parquet", "orphan.tmp"}
+    assert len(names) == 3
+
+
+def test_csv_export_quotes_only_when_needed():
+    at = run_app(HEADER + "B1,C1,L1,1,10,3,2,50\nB2,C2,L1,2,20,2,1,10\n")
+    lines = at.session_state["download"].decode().splitlines()
+    assert lines[0].startswith("BILL_OF_LADING,CARRIER_NAME,")
+    assert lines[1].startswith("B1,C1,L1,")
+
+    at = run_app(HEADER + 'B1,"Acme, Inc.",L1,1,10,3,2,50\nB2,C2,L1,2,20,2,1,10\n')
+    lines = at.session_state["download"].decode().splitlines()
+    assert lines[0].startswith("BILL_OF_LADING,CARRIER_NAME,")
+    assert lines[1].startswith('"B1","Acme, Inc.","L1",')
+
+
+def test_stop_range_is_inclusive_and_skips_missing_stops():
+    at = run_app(
+        HEADER
+        + "B1,C1,L1,1,10,3,2,50\nB2,C1,L1,1.5,10,3,2,50\nB3,C1,L1,2,10,3,2,50\n"
+        + "B4,C1,L1,,10,3,2,50\nB5,C1,L1,3,10,3,2,50\n"
+    )
+    assert at.sidebar.slider[0].value == (1, 3)
+    at.sidebar.slider[0].set_value((1, 2)).run()
+    assert at.dataframe[0].value["BILL_OF_LADING"].tolist() == ["B1", "B2", "B3"]
+    at.sidebar.slider[0].set_value((2, 2)).run()
+    assert at.dataframe[0].value["BILL_OF_LADING"].tolist() == ["B3"]
+
+
+def test_deselecting_all_lanes_shows_no_rows():
+    at = run_app(HEADER + "B1,C1,L1,1,10,3,2,50\nB2,C2,L2,2,20,2,1,10\n")
+    at.sidebar.multiselect[1].set_value(["L2"]).run()
+    assert at.dataframe[0].value["BILL_OF_LADING"].tolist() == ["B2"]
+    at.sidebar.multiselect[1].set_value([]).run()
+    assert not at.dataframe
+    assert "No rows match" in at.warning[0].value
+
+
+def test_bucket_only_rerun_reuses_shipment_table(monkeypatch):
+    calls = []
+    index_in = pc.index_in
+    monkeypatch.setattr(pc, "index_in", lambda *args, **kwargs: calls.append(1) or index_in(*args, **kwargs))
+    header = HEADER.replace("\n", ",COUNT_OF_ACCURATE_PREDICTIONS_60_MINS,ACCURACY_60_MINS\n")
+    at = run_app(header + "B1,C1,L1,1,10,3,2,50,3,90\nB1,C1,L1,2,10,3,2,50,3,90\nB2,C2,L1,2,20,2,1,10,2,80\n")
+    assert len(calls) == 1
+    at.sidebar.multiselect[0].set_value([60]).run()
+    assert len(calls) == 1
+    out = at.dataframe[0].value
+    assert out.columns[-2:].tolist() == ["COUNT_OF_ACCURATE_PREDICTIONS_60_MINS", "ACCURACY_60_MINS"]
+    assert "ACCURACY_30_MINS" not in out.columns
+    assert out["BILL_OF_LADING"].tolist() == ["B1", "B2"]
+    assert out["ACCURACY_60_MINS"].tolist() == [90, 80]
+
+
+def test_numeric_lanes_are_filtered_as_text():
+    at = run_app(HEADER + "B1,C1,101,1,10,3,2,50\nB2,C2,102,2,20,2,1,10\n")
+    assert at.sidebar.multiselect[1].options == ["101", "102"]
+    at.sidebar.multiselect[1].set_value(["102"]).run()
+    assert at.dataframe[0].value["BILL_OF_LADING"].tolist() == ["B2"]